@@ -4,47 +4,75 @@ Convert YOLOv8 model to ONNX format for browser deployment
 """
 
 from ultralytics import YOLO
+from pathlib import Path
+from typing import Union
 import argparse
 import os
+import torch
+
+# Supported by onnxruntime-web 1.17+ (see package.json)
+ONNX_OPSET = 17
+
+
+def load_model(model_path: str) -> YOLO:
+    """
+    Load a YOLOv8 PyTorch model once so several variants can be exported from it
+    
+    Args:
+        model_path: Path to YOLOv8 .pt model
+    """
+    print(f"Loading model from {model_path}...")
+    return YOLO(model_path)
 
 
 def convert_to_onnx(
-    model_path: str = "yolov8n.pt",
+    model: Union[str, YOLO] = "yolov8n.pt",
     output_path: str = "../public/models/yolov8n.onnx",
     imgsz: int = 640,
-    simplify: bool = True
+    simplify: bool = True,
+    half: bool = False
 ):
     """
     Convert YOLOv8 PyTorch model to ONNX format
     
     Args:
-        model_path: Path to YOLOv8 .pt model
+        model: Path to YOLOv8 .pt model, or a model from load_model()
         output_path: Where to save ONNX model
         imgsz: Input image size
         simplify: Whether to simplify ONNX model
+        half: Export FP16 weights (requires a CUDA GPU)
     """
-    print(f"Loading model from {model_path}...")
-    model = YOLO(model_path)
+    if half and not torch.cuda.is_available():
+        # Ultralytics would silently export FP32 weights instead
+        print(f"✗ FP16 export needs a CUDA GPU - skipping {output_path}")
+        return
     
-    print(f"Converting to ONNX (size={imgsz})...")
-    model.export(
+    if isinstance(model, str):
+        model = load_model(model)
+    
+    print(f"Converting to ONNX (size={imgsz}, {'fp16' if half else 'fp32'})...")
+    onnx_file = model.export(
         format="onnx",
         imgsz=imgsz,
+        half=half,
+        device=0 if half else "cpu",  # FP16 export is GPU-only
         simplify=simplify,
-        opset=12,  # ONNX opset version
+        opset=ONNX_OPSET,
         dynamic=False,  # Static shape for better browser performance
     )
     
     # Move to output location
-    onnx_file = model_path.replace('.pt', '.onnx')
-    if os.path.exists(onnx_file):
+    if onnx_file and os.path.exists(onnx_file):
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        os.rename(onnx_file, output_path)
+        if Path(onnx_file).resolve() != Path(output_path).resolve():
+            # Overwrites an existing output, unlike os.rename on Windows
+            Path(onnx_file).replace(output_path)
         print(f"✓ Model saved to {output_path}")
         
         # Print file size
         size_mb = os.path.getsize(output_path) / (1024 * 1024)
         print(f"✓ Model size: {size_mb:.2f} MB")
+        print(f"✓ ONNX opset: {ONNX_OPSET}")
     else:
         print(f"✗ Conversion failed - {onnx_file} not found")
 
@@ -74,15 +102,33 @@ def main():
         action="store_true",
         help="Don't simplify ONNX model"
     )
+    parser.add_argument(
+        "--fp16",
+        action="store_true",
+        help="Also export half-precision weights to <output>.fp16.onnx "
+             "(requires a CUDA GPU)"
+    )
     
     args = parser.parse_args()
     
+    # Deserialize the checkpoint once for every variant
+    model = load_model(args.model)
+    
     convert_to_onnx(
-        model_path=args.model,
+        model=model,
         output_path=args.output,
         imgsz=args.size,
         simplify=not args.no_simplify
     )
+    
+    if args.fp16:
+        convert_to_onnx(
+            model=model,
+            output_path=args.output.replace('.onnx', '.fp16.onnx'),
+            imgsz=args.size,
+            simplify=not args.no_simplify,
+            half=True
+        )
 
 
 if __name__ == "__main__":
@@ -5,12 +5,278 @@ This runs LOCALLY - creates a file you can use in the browser!
 """
 
 from ultralytics import YOLO
+from ultralytics.data.augment import LetterBox
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    CalibrationMethod,
+    QuantFormat,
+    QuantType,
+    quantize_static,
+)
+from datetime import datetime
+from pathlib import Path
+import argparse
+import csv
+import cv2
+import numpy as np
+import onnx
+import onnxruntime as ort
 import os
 import shutil
+import subprocess
+import sys
+import torch
 
-def convert_to_browser_format():
+# onnxruntime-web 1.17 (package.json) supports opset 17, which lets
+# LayerNorm/Resize subgraphs export as single fusable ops
+ONNX_OPSET = 17
+
+BENCHMARK_CSV = 'runs/detect/screen-detector/benchmark.csv'
+
+# Ops the onnxruntime-web WebNN execution provider can hand to the browser's
+# native backend (GPU/NPU). Anything else falls back to WASM mid-graph.
+WEBNN_SUPPORTED_OPS = {
+    'Add', 'ArgMax', 'AveragePool', 'BatchNormalization', 'Cast', 'Clip',
+    'Concat', 'Constant', 'Conv', 'ConvTranspose', 'DequantizeLinear', 'Div',
+    'Expand', 'Flatten', 'Gather', 'Gemm', 'GlobalAveragePool', 'HardSigmoid',
+    'HardSwish', 'Identity', 'LeakyRelu', 'MatMul', 'Max', 'MaxPool', 'Min',
+    'Mul', 'Pad', 'Pow', 'QuantizeLinear', 'ReduceMax', 'ReduceMean', 'Relu',
+    'Reshape', 'Resize', 'Shape', 'Sigmoid', 'Slice', 'Softmax', 'Split',
+    'Sqrt', 'Squeeze', 'Sub', 'Tanh', 'Transpose', 'Unsqueeze', 'Where',
+}
+
+
+class YoloCalibReader(CalibrationDataReader):
+    """
+    Feed validation images to the INT8 calibrator using the same
+    preprocessing as training (letterboxed with 114 padding, RGB, NCHW,
+    float32 in [0, 1])
+    """
+
+    def __init__(self, images_dir, input_name, imgsz=640):
+        self.input_name = input_name
+        self.imgsz = imgsz
+        # Keeps the aspect ratio of 16:9 screenshots, like Ultralytics does
+        self.letterbox = LetterBox((imgsz, imgsz), auto=False)
+        self.images = sorted(
+            p for p in Path(images_dir).glob("*")
+            if p.suffix.lower() in (".png", ".jpg", ".jpeg")
+        )
+        self._iter = iter(self.images)
+
+    def get_next(self):
+        for img_path in self._iter:
+            img = cv2.imread(str(img_path))
+            if img is None:
+                continue
+            img = self.letterbox(image=img)
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            img = img.transpose(2, 0, 1)[np.newaxis].astype(np.float32) / 255.0
+            return {self.input_name: img}
+        return None
+
+    def rewind(self):
+        self._iter = iter(self.images)
+
+
+def quantize_int8(fp32_path, int8_path, calib_dir='dataset/valid/images', imgsz=640):
+    """
+    Post-training static INT8 quantization (QDQ format)
+
+    Args:
+        fp32_path: Exported FP32 ONNX model
+        int8_path: Where to save the INT8 model
+        calib_dir: Images used for calibration (validation split)
+        imgsz: Input image size the model was exported with
+    """
+    input_name = onnx.load(fp32_path).graph.input[0].name
+    reader = YoloCalibReader(calib_dir, input_name, imgsz=imgsz)
+
+    if len(reader.images) == 0:
+        print(f"❌ No calibration images found in {calib_dir}")
+        print("Run: python prepare_dataset.py")
+        return False
+
+    print(f"🔄 Quantizing to INT8 ({len(reader.images)} calibration images)...")
+    quantize_static(
+        fp32_path,
+        int8_path,
+        reader,
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        weight_type=QuantType.QInt8,
+        activation_type=QuantType.QUInt8,
+        calibrate_method=CalibrationMethod.Percentile,
+    )
+    return True
+
+
+def optimize_offline(onnx_path):
+    """
+    Pre-bake graph optimizations so the browser doesn't redo them on every load
+
+    Runs onnx-simplifier in place, then lets ONNX Runtime write out its
+    optimized graph next to the input as <name>.opt.onnx.
+
+    Args:
+        onnx_path: ONNX model to optimize
+
+    Returns:
+        Path of the optimized model
+    """
+    print("🔄 Simplifying graph with onnxsim...")
+    result = subprocess.run(
+        [sys.executable, "-m", "onnxsim", onnx_path, onnx_path],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        print("⚠️  onnxsim failed, continuing with the unsimplified graph")
+        print(result.stderr.strip())
+
+    # BASIC level only: constant folding, Conv+BN fusion, redundant node
+    # elimination. Higher levels emit CPU-specific contrib ops that
+    # onnxruntime-web can't load.
+    opt_path = onnx_path.replace('.onnx', '.opt.onnx')
+    so = ort.SessionOptions()
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_BASIC
+    so.optimized_model_filepath = opt_path
+    ort.InferenceSession(onnx_path, so, providers=['CPUExecutionProvider'])
+    return opt_path
+
+
+def webnn_unsupported_ops(onnx_path):
+    """
+    List the ops in a model that the WebNN backend would hand back to WASM
+
+    Args:
+        onnx_path: ONNX model the browser will load
+
+    Returns:
+        Sorted list of unsupported op types in the graph
+    """
+    graph = onnx.load(onnx_path).graph
+    return sorted({node.op_type for node in graph.node} - WEBNN_SUPPORTED_OPS)
+
+
+def export_variant(model, destination, half=False):
+    """
+    Export one ONNX variant from an already loaded model
+
+    All variants share the same YOLO instance, so the checkpoint is only
+    deserialized once per run.
+
+    Args:
+        model: Loaded YOLO model
+        destination: Where to copy the exported ONNX file
+        half: Export FP16 weights (GPU only)
+    """
+    onnx_file = model.export(
+        format='onnx',
+        imgsz=640,
+        half=half,
+        simplify=True,  # Simplify for better browser performance
+        opset=ONNX_OPSET,
+        dynamic=False,  # Static shape for browser
+        device=0 if half and torch.cuda.is_available() else 'cpu',
+    )
+    shutil.copy(onnx_file, destination)
+
+
+def validate_onnx(onnx_path, half=False, device='cpu'):
+    """
+    Measure an ONNX model's accuracy on the validation split
+
+    Ultralytics runs the model through ONNX Runtime with the same
+    preprocessing as training and scores it with its own mAP metrics.
+    device='cpu' keeps it on the installed onnxruntime package; on a CUDA
+    device Ultralytics would install onnxruntime-gpu next to it.
+
+    Returns:
+        (mAP50, mAP50-95)
+    """
+    metrics = YOLO(onnx_path, task='detect').val(
+        data='dataset/data.yaml',
+        imgsz=640,
+        half=half,
+        device=device,
+        plots=False,
+        verbose=False,
+    )
+    return metrics.box.map50, metrics.box.map
+
+
+def log_benchmark(variant, onnx_path, map50, map50_95):
+    """Append one row to runs/detect/screen-detector/benchmark.csv"""
+    csv_path = Path(BENCHMARK_CSV)
+    is_new = not csv_path.exists()
+    with csv_path.open('a', newline='') as f:
+        writer = csv.writer(f)
+        if is_new:
+            writer.writerow(['timestamp', 'variant', 'file', 'size_mb', 'map50', 'map50_95'])
+        writer.writerow([
+            datetime.now().isoformat(timespec='seconds'),
+            variant,
+            onnx_path,
+            f"{os.path.getsize(onnx_path) / (1024 * 1024):.2f}",
+            f"{map50:.4f}",
+            f"{map50_95:.4f}",
+        ])
+
+
+def validate_quantized(onnx_path, variant, fp32_map50, max_map_drop=0.05,
+                       half=False, device='cpu'):
+    """
+    Accuracy gate for reduced-precision models
+
+    A bad INT8 calibration can silently lose most of a model's mAP, so a
+    variant is only shipped if its mAP50 stays within max_map_drop of FP32.
+
+    Args:
+        onnx_path: Reduced-precision ONNX model to check
+        variant: Name used in logs and benchmark.csv ('int8', 'fp16')
+        fp32_map50: mAP50 of the FP32 model on the same split
+        max_map_drop: Largest allowed relative mAP50 drop (0.05 = 5%)
+        half: Feed FP16 inputs (for FP16 models)
+        device: Device to run ONNX Runtime on
+
+    Returns:
+        True if the model is accurate enough to ship
+    """
+    print(f"📊 Validating {variant.upper()} model...")
+    map50, map50_95 = validate_onnx(onnx_path, half=half, device=device)
+    log_benchmark(variant, onnx_path, map50, map50_95)
+
+    if map50 < (1 - max_map_drop) * fp32_map50:
+        print(f"\033[91m❌ {variant.upper()} mAP50 {map50:.3f} is more than "
+              f"{max_map_drop:.0%} below FP32 ({fp32_map50:.3f}) - not shipping it.\033[0m")
+        print("   The FP32 model stays the one to use.")
+        return False
+
+    print(f"✓ {variant.upper()} mAP50: {map50:.3f} (FP32: {fp32_map50:.3f})")
+    return True
+
+
+def remove_stale(destination):
+    """
+    Delete a variant left in public/models by an earlier run
+
+    Used when this run doesn't ship the variant, so the browser can't pick
+    up a model from a different training run next to the new FP32 one.
+    """
+    if os.path.exists(destination):
+        os.remove(destination)
+        print(f"🗑️  Removed old {destination}")
+
+
+def convert_to_browser_format(quantize=None, webgpu=True, max_map_drop=0.05):
     """
     Convert the trained model to ONNX format for browser deployment
+
+    Args:
+        quantize: Optional quantization mode ('int8') emitted alongside FP32
+        webgpu: Also emit an FP16 model for the WebGPU execution provider
+        max_map_drop: Largest relative mAP50 drop allowed for INT8/FP16 models
     """
     
     print("=" * 60)
@@ -39,23 +305,80 @@ def convert_to_browser_format():
     print("This will take 1-2 minutes...")
     print()
     
-    model.export(
-        format='onnx',
-        imgsz=640,
-        simplify=True,  # Simplify for better browser performance
-        opset=12,       # ONNX opset version
-        dynamic=False,  # Static shape for browser
-    )
-    
     # Move to public/models folder
-    onnx_file = model_path.replace('.pt', '.onnx')
     destination = '../public/models/screen-detector.onnx'
-    
     os.makedirs(os.path.dirname(destination), exist_ok=True)
-    shutil.copy(onnx_file, destination)
+    export_variant(model, destination)
     
+    # Pre-optimized graph is the one the browser should load
+    print()
+    opt_destination = optimize_offline(destination)
+
+    # The optimized model only contains standard ONNX ops, so WebNN
+    # browsers can load it as-is; just report anything WebNN can't run
+    webnn_fallback_ops = webnn_unsupported_ops(opt_destination)
+
     # Get file size
     size_mb = os.path.getsize(destination) / (1024 * 1024)
+
+    # Baseline accuracy for the INT8/FP16 gates
+    fp32_map50 = None
+    if quantize == 'int8' or (webgpu and torch.cuda.is_available()):
+        print()
+        print("📊 Validating FP32 model...")
+        fp32_map50, fp32_map50_95 = validate_onnx(destination)
+        log_benchmark('fp32', destination, fp32_map50, fp32_map50_95)
+        print(f"✓ FP32 mAP50: {fp32_map50:.3f}")
+
+    # Reduced-precision models are built next to the weights and only
+    # copied to public/models once they pass the accuracy gate
+    weights_dir = os.path.dirname(model_path)
+
+    # Optional INT8 variant (FP32 is always kept so callers pick the tradeoff)
+    int8_destination = '../public/models/screen-detector.int8.onnx'
+    int8_size_mb = None
+    if quantize == 'int8':
+        print()
+        int8_staging = os.path.join(weights_dir, 'best.int8.onnx')
+        if (quantize_int8(destination, int8_staging)
+                and validate_quantized(int8_staging, 'int8', fp32_map50, max_map_drop)):
+            shutil.copy(int8_staging, int8_destination)
+            int8_size_mb = os.path.getsize(int8_destination) / (1024 * 1024)
+        else:
+            remove_stale(int8_destination)
+
+    # WebGPU variant: FP16 runs on GPU compute shaders at half the size.
+    # The WASM backend has no FP16 kernels, so it keeps the FP32/INT8 files.
+    fp16_destination = '../public/models/screen-detector.webgpu.fp16.onnx'
+    fp16_size_mb = None
+    if webgpu and not torch.cuda.is_available():
+        print()
+        print("⚠️  No CUDA GPU found - skipping the WebGPU FP16 model")
+        print("   (Ultralytics only exports FP16 on GPU)")
+        remove_stale(fp16_destination)
+    elif webgpu:
+        print()
+        print("🔄 Converting to FP16 ONNX format for WebGPU...")
+        fp16_staging = os.path.join(weights_dir, 'best.fp16.onnx')
+        export_variant(model, fp16_staging, half=True)
+        # The CPU onnxruntime package has no FP16 Conv kernels on x86, so the
+        # FP16 model can only be checked where the CUDA provider is installed
+        if 'CUDAExecutionProvider' in ort.get_available_providers():
+            fp16_ok = validate_quantized(
+                fp16_staging, 'fp16', fp32_map50, max_map_drop,
+                half=True, device=0,
+            )
+        else:
+            print("⚠️  FP16 model not validated - onnxruntime has no CUDA provider")
+            print(f"   here, so it was NOT copied to {fp16_destination}.")
+            print(f"   Unvalidated model: {fp16_staging}")
+            print("   Install onnxruntime-gpu and re-run to validate and ship it.")
+            fp16_ok = False
+        if fp16_ok:
+            shutil.copy(fp16_staging, fp16_destination)
+            fp16_size_mb = os.path.getsize(fp16_destination) / (1024 * 1024)
+        else:
+            remove_stale(fp16_destination)
     
     print()
     print("=" * 60)
@@ -64,13 +387,35 @@ def convert_to_browser_format():
     print()
     print(f"✓ Model saved to: {destination}")
     print(f"✓ File size: {size_mb:.2f} MB")
+    print(f"✓ ONNX opset: {ONNX_OPSET}")
+    print(f"✓ Optimized model saved to: {opt_destination}")
+    if fp32_map50 is not None:
+        print(f"✓ Accuracy log: {BENCHMARK_CSV}")
+    if webnn_fallback_ops:
+        print(f"⚠️  Ops WebNN will run on WASM: {', '.join(webnn_fallback_ops)}")
+    if int8_size_mb is not None:
+        print(f"✓ INT8 model saved to: {int8_destination}")
+        print(f"✓ INT8 file size: {int8_size_mb:.2f} MB")
+    if fp16_size_mb is not None:
+        print(f"✓ WebGPU FP16 model saved to: {fp16_destination}")
+        print(f"✓ FP16 file size: {fp16_size_mb:.2f} MB ({fp16_size_mb / size_mb:.0%} of FP32)")
     print()
     print("=" * 60)
     print("NEXT STEPS:")
     print("=" * 60)
     print()
     print("1. Update src/config.ts:")
-    print("   MODEL_PATH: '/models/screen-detector.onnx'")
+    print("   MODEL_PATH: '/models/screen-detector.opt.onnx'")
+    if fp16_size_mb is not None:
+        print("   When navigator.gpu exists, load the FP16 model instead:")
+        print("   '/models/screen-detector.webgpu.fp16.onnx' with")
+        print("   executionProviders: ['webgpu', 'wasm']")
+        print("   Its input and output are float16: feed it an ort.Tensor('float16',")
+        print("   Uint16Array of half-float bits, [1, 3, 640, 640]) and decode the")
+        print("   float16 output - a Float32Array input will be rejected.")
+    print("   When navigator.ml exists (WebNN), load the same")
+    print("   '/models/screen-detector.opt.onnx' with")
+    print("   executionProviders: ['webnn', 'wasm']")
     print()
     print("2. Update class names in src/config.ts:")
     print("   export const CLASS_NAMES = [")
@@ -86,5 +431,35 @@ def convert_to_browser_format():
     print("No backend needed! 🎉")
     print()
 
+def main():
+    parser = argparse.ArgumentParser(description="Convert trained model to ONNX")
+    parser.add_argument(
+        "--quantize",
+        choices=["int8"],
+        default=None,
+        help="Also emit a quantized model (calibrated on dataset/valid/images)"
+    )
+    parser.add_argument(
+        "--no-webgpu",
+        action="store_true",
+        help="Don't emit the FP16 WebGPU model"
+    )
+    parser.add_argument(
+        "--max-map-drop",
+        type=float,
+        default=0.05,
+        help="Don't ship INT8/FP16 models whose mAP50 is more than this "
+             "fraction below FP32 (default: 0.05)"
+    )
+
+    args = parser.parse_args()
+
+    convert_to_browser_format(
+        quantize=args.quantize,
+        webgpu=not args.no_webgpu,
+        max_map_drop=args.max_map_drop,
+    )
+
+
 if __name__ == "__main__":
-    convert_to_browser_format()
+    main()
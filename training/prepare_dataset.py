@@ -4,13 +4,68 @@ Prepare dataset for training after labeling with LabelImg
 Splits images into train/valid/test sets
 """
 
+import argparse
 import os
 import shutil
-import random
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 
-def prepare_dataset():
-    """Split labeled images into train/valid/test sets"""
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg"}
+
+DATA_YAML_TEMPLATE = """# Dataset configuration for YOLOv8
+path: {path}
+train: train/images
+val: valid/images
+test: test/images
+
+# Number of classes
+nc: {nc}
+
+# Class names (UPDATE THESE!)
+names:
+{names}"""
+
+def cache_image_npy(img_path, imgsz=640):
+    """
+    Decode an image once and save it as <name>.npy next to it
+
+    Ultralytics loads <name>.npy instead of decoding the image when it
+    exists, so every later training run skips PNG/JPEG decoding. The long
+    side is pre-resized to imgsz (aspect ratio kept, as YOLO does itself);
+    labels are normalized, so they stay valid.
+    """
+    npy_path = img_path.with_suffix(".npy")
+    img = cv2.imread(str(img_path))  # BGR, same as Ultralytics
+    if img is None:
+        if npy_path.exists():
+            npy_path.unlink()  # Don't leave a stale cache behind
+        return False
+    h, w = img.shape[:2]
+    r = imgsz / max(h, w)
+    if r != 1:
+        img = cv2.resize(
+            img,
+            (min(round(w * r), imgsz), min(round(h * r), imgsz)),
+            interpolation=cv2.INTER_LINEAR if r > 1 else cv2.INTER_AREA,
+        )
+    np.save(npy_path, img, allow_pickle=False)
+    return True
+
+def prepare_dataset(link=True, cache_npy=False):
+    """
+    Split labeled images into train/valid/test sets
+
+    Args:
+        link: Hardlink files into the splits instead of copying them.
+            Each split file is its own directory entry, so deleting e.g.
+            dataset/train/images/x.png leaves dataset/images/x.png intact -
+            but editing a file in place changes both.
+        cache_npy: Pre-decode split images to .npy files for faster training
+    """
     
     # Paths
     images_dir = Path("dataset/images")
@@ -27,8 +82,13 @@ def prepare_dataset():
         print("Please label your images first using LabelImg.")
         return
     
-    # Get all images
-    image_files = list(images_dir.glob("*.png")) + list(images_dir.glob("*.jpg"))
+    # Get all images (single directory pass, filtered by extension)
+    with os.scandir(images_dir) as entries:
+        image_files = [
+            Path(entry.path) for entry in entries
+            if entry.name[entry.name.rfind("."):].lower() in IMAGE_EXTENSIONS
+            and entry.is_file()
+        ]
     
     if len(image_files) == 0:
         print("❌ No images found in dataset/images/")
@@ -45,12 +105,14 @@ def prepare_dataset():
     print(f"✓ Found {len(image_files)} images")
     print(f"✓ Found {len(label_files)} labels")
     
-    # Filter images that have labels
+    # Filter images that have labels (one directory listing, no stat per image)
+    # Entries are (image, stem, label) so no Path attribute is parsed twice
+    label_by_stem = {label_file.stem: label_file for label_file in label_files}
     labeled_images = []
     for img in image_files:
-        label_file = labels_dir / f"{img.stem}.txt"
-        if label_file.exists():
-            labeled_images.append(img)
+        stem = img.stem
+        if stem in label_by_stem:
+            labeled_images.append((img, stem, label_by_stem[stem]))
     
     print(f"✓ {len(labeled_images)} images have labels")
     
@@ -58,63 +120,124 @@ def prepare_dataset():
         print("⚠️  Warning: Very few labeled images. Accuracy will be limited.")
         print("   Recommended: 50+ images for decent results")
     
-    # Shuffle
-    random.seed(42)
-    random.shuffle(labeled_images)
+    # Get class IDs from labels
+    def read_class_ids(label_file):
+        # Only the first token of each line matters, so read the file in
+        # one go and split bytes instead of iterating lines
+        return [
+            int(line.split(None, 1)[0])
+            for line in label_file.read_bytes().splitlines()
+            if line.strip()
+        ]
+
+    with ThreadPoolExecutor(max_workers=(os.cpu_count() or 1) * 4) as executor:
+        label_ids = dict(zip(
+            label_by_stem,
+            executor.map(read_class_ids, label_by_stem.values()),
+        ))
+    classes = set().union(*label_ids.values())
+    
+    # Sorted so the seeded split doesn't depend on directory listing order
+    labeled_images.sort(key=lambda entry: entry[1])
+    
+    # Stratified shuffle: group images by their most common class and split
+    # each group 70/20/10, so small datasets don't end up with a class that
+    # only appears in one split
+    groups = defaultdict(list)
+    for entry in labeled_images:
+        ids = label_ids[entry[1]]
+        groups[Counter(ids).most_common(1)[0][0] if ids else -1].append(entry)
     
-    # Split ratios
-    total = len(labeled_images)
-    train_split = int(0.7 * total)
-    valid_split = int(0.9 * total)
+    rng = np.random.default_rng(42)
+    train_images, valid_images, test_images = [], [], []
+    for class_id in sorted(groups):
+        group = groups[class_id]
+        idx = rng.permutation(len(group))
+        # Round half up (round() would send e.g. 4.5 to 4)
+        train_split = int(0.7 * len(group) + 0.5)
+        valid_split = int(0.9 * len(group) + 0.5)
+        train_images += [group[i] for i in idx[:train_split]]
+        valid_images += [group[i] for i in idx[train_split:valid_split]]
+        test_images += [group[i] for i in idx[valid_split:]]
     
-    train_images = labeled_images[:train_split]
-    valid_images = labeled_images[train_split:valid_split]
-    test_images = labeled_images[valid_split:]
+    # Training needs at least one validation image
+    if not valid_images:
+        if test_images:
+            valid_images.append(test_images.pop())
+        elif len(train_images) > 1:
+            valid_images.append(train_images.pop())
     
     print(f"\nSplit:")
     print(f"  Train: {len(train_images)} images")
     print(f"  Valid: {len(valid_images)} images")
     print(f"  Test: {len(test_images)} images")
     
-    # Create directories
+    # Create directories, emptying any from an earlier run so an image
+    # can't end up in two splits (originals in dataset/images are untouched)
     for split in ['train', 'valid', 'test']:
-        (Path("dataset") / split / "images").mkdir(parents=True, exist_ok=True)
-        (Path("dataset") / split / "labels").mkdir(parents=True, exist_ok=True)
+        for sub in ['images', 'labels']:
+            split_dir = Path("dataset") / split / sub
+            if split_dir.exists():
+                shutil.rmtree(split_dir)
+            split_dir.mkdir(parents=True)
     
     # Copy files
-    def copy_split(images, split_name):
-        for img in images:
-            # Copy image
-            shutil.copy(
-                img,
-                Path("dataset") / split_name / "images" / img.name
-            )
-            # Copy label
-            label_file = labels_dir / f"{img.stem}.txt"
-            if label_file.exists():
-                shutil.copy(
-                    label_file,
-                    Path("dataset") / split_name / "labels" / f"{img.stem}.txt"
-                )
-    
-    print("\nCopying files...")
-    copy_split(train_images, "train")
-    copy_split(valid_images, "valid")
-    copy_split(test_images, "test")
+    def place_file(src, dest):
+        # Replace rather than overwrite: dest may be a hardlink to src from
+        # an earlier run, which copyfile() refuses (SameFileError)
+        if dest.exists():
+            dest.unlink()
+        if link:
+            try:
+                os.link(src, dest)
+                return
+            except OSError:
+                pass  # Different filesystem - fall back to copying
+        shutil.copyfile(src, dest)
+
+    def copy_pair(entry, split_name):
+        img, stem, label_file = entry
+        # Copy image
+        place_file(img, Path("dataset") / split_name / "images" / img.name)
+        # Copy label (every split image is known to have one)
+        place_file(
+            label_file,
+            Path("dataset") / split_name / "labels" / f"{stem}.txt"
+        )
+
+    def copy_split(executor, images, split_name):
+        return [executor.submit(copy_pair, entry, split_name) for entry in images]
+    
+    # Copies are I/O bound, so overlap them across threads
+    print("\nLinking files..." if link else "\nCopying files...")
+    with ThreadPoolExecutor(max_workers=(os.cpu_count() or 1) * 4) as executor:
+        futures = (
+            copy_split(executor, train_images, "train")
+            + copy_split(executor, valid_images, "valid")
+            + copy_split(executor, test_images, "test")
+        )
+        for future in futures:
+            future.result()
     
     print("✓ Files copied!")
+
+    if cache_npy:
+        # Decoding is CPU bound, so use processes rather than threads
+        print("\nDecoding images to .npy cache...")
+        split_images = [
+            Path("dataset") / split_name / "images" / img.name
+            for split_name, images in (
+                ("train", train_images),
+                ("valid", valid_images),
+                ("test", test_images),
+            )
+            for img, _, _ in images
+        ]
+        with ProcessPoolExecutor() as executor:
+            cached = sum(executor.map(cache_image_npy, split_images, chunksize=8))
+        print(f"✓ Cached {cached} images")
     
     # Create data.yaml
-    # Get unique class names from labels
-    classes = set()
-    for label_file in label_files:
-        with open(label_file, 'r') as f:
-            for line in f:
-                parts = line.strip().split()
-                if parts:
-                    class_id = int(parts[0])
-                    classes.add(class_id)
-    
     # Create class names (you'll need to map these)
     print("\n" + "="*50)
     print("IMPORTANT: Update class names in data.yaml")
@@ -130,24 +253,16 @@ def prepare_dataset():
     print("="*50)
     
     # Create data.yaml
-    yaml_content = f"""# Dataset configuration for YOLOv8
-path: {Path.cwd() / 'dataset'}
-train: train/images
-val: valid/images
-test: test/images
-
-# Number of classes
-nc: {len(classes)}
-
-# Class names (UPDATE THESE!)
-names:
-"""
-    
-    for i in sorted(classes):
-        yaml_content += f"  {i}: class_{i}  # TODO: Replace with actual name (vscode, chrome, etc.)\n"
-    
-    with open("dataset/data.yaml", "w") as f:
-        f.write(yaml_content)
+    names = [
+        f"  {i}: class_{i}  # TODO: Replace with actual name (vscode, chrome, etc.)\n"
+        for i in sorted(classes)
+    ]
+    yaml_content = DATA_YAML_TEMPLATE.format(
+        path=Path.cwd() / 'dataset',
+        nc=len(classes),
+        names="".join(names),
+    )
+    Path("dataset/data.yaml").write_text(yaml_content)
     
     print(f"\n✓ Created dataset/data.yaml")
     print("\n" + "="*50)
@@ -158,5 +273,25 @@ names:
     print("3. Run: python train_model.py")
     print("="*50)
 
+def main():
+    parser = argparse.ArgumentParser(description="Split labeled dataset")
+    parser.add_argument(
+        "--copy",
+        action="store_true",
+        help="Copy files instead of hardlinking them (use if something "
+             "modifies the split files in place)"
+    )
+
+    parser.add_argument(
+        "--cache-npy",
+        action="store_true",
+        help="Decode images once into .npy files that training loads directly"
+    )
+
+    args = parser.parse_args()
+
+    prepare_dataset(link=not args.copy, cache_npy=args.cache_npy)
+
+
 if __name__ == "__main__":
-    prepare_dataset()
+    main()
@@ -4,12 +4,252 @@ Train YOLOv8 model for screen region detection
 This runs LOCALLY on your computer - no server needed!
 """
 
+from copy import deepcopy
+from torch import nn
+from torch.ao.nn import intrinsic as nni
+from torch.ao.nn.intrinsic import qat as nniqat
+from torch.ao.nn import qat as nnqat
+from torch.ao.quantization import (
+    FakeQuantize,
+    MovingAverageMinMaxObserver,
+    MovingAveragePerChannelMinMaxObserver,
+    QConfig,
+    convert,
+    disable_observer,
+    fuse_modules_qat,
+    get_default_qat_module_mappings,
+)
+from torch.nn.utils.fusion import fuse_conv_bn_weights
 from ultralytics import YOLO
+from ultralytics.nn.modules import Conv, Detect
+from ultralytics.utils.torch_utils import ModelEMA
+import argparse
+import importlib.util
+import onnx
 import os
+import platform
+import torch
 
-def train_screen_detector():
+# Per-channel symmetric INT8 weights, per-tensor asymmetric UINT8 activations.
+# Plain FakeQuantize (not the fused default) so torch.onnx.export can turn
+# every fake-quant node into a QuantizeLinear/DequantizeLinear pair.
+QAT_QCONFIG = QConfig(
+    activation=FakeQuantize.with_args(
+        observer=MovingAverageMinMaxObserver,
+        quant_min=0,
+        quant_max=255,
+        dtype=torch.quint8,
+        qscheme=torch.per_tensor_affine,
+    ),
+    weight=FakeQuantize.with_args(
+        observer=MovingAveragePerChannelMinMaxObserver,
+        quant_min=-128,
+        quant_max=127,
+        dtype=torch.qint8,
+        qscheme=torch.per_channel_symmetric,
+        ch_axis=0,
+    ),
+)
+
+def fake_quant_input(module, args):
+    """Forward pre-hook: fake-quantize a conv's input activation"""
+    return (module.input_fake_quant(args[0]),) + tuple(args[1:])
+
+def add_input_fake_quant(module, fake_quant):
+    """Quantize everything that flows into `module`, as INT8 convs do"""
+    module.input_fake_quant = fake_quant
+    module.register_forward_pre_hook(fake_quant_input)
+
+def insert_fake_quant(trainer):
+    """
+    Ultralytics callback: swap Conv2d layers for fake-quantized QAT versions
+
+    Runs after the optimizer is built. Conv+BN pairs are fused first, the
+    same way they are folded at export. Every QAT conv fake-quantizes its
+    weights and its input activation - the tensors an INT8 conv consumes
+    and where quantize_static puts its Q/DQ pairs. QAT modules reuse the
+    original conv/BN Parameters, so the optimizer keeps training them;
+    only the EMA copy has to be rebuilt.
+    """
+    model = trainer.model
+    model.train()
+    fused = [
+        (name, m) for name, m in model.named_modules()
+        if isinstance(m, Conv) and isinstance(m.bn, nn.BatchNorm2d)
+    ]
+    fuse_modules_qat(
+        model,
+        [[f"{name}.conv", f"{name}.bn"] for name, _ in fused],
+        inplace=True,
+    )
+    for _, m in fused:
+        # BN now lives inside the ConvBn2d. Dropping the Identity left
+        # behind makes Ultralytics' fuse() (used when validating best.pt)
+        # skip this block instead of failing on Identity.weight.
+        del m.bn
+        m.forward = m.forward_fuse
+    for m in model.modules():
+        if isinstance(m, nni.ConvBn2d):
+            m.qconfig = QAT_QCONFIG
+        # Skip frozen convs (the fixed DFL projection in the Detect head)
+        elif isinstance(m, nn.Conv2d) and m.weight.requires_grad:
+            m.qconfig = QAT_QCONFIG
+    # Module swap only; activation quantization is added on conv inputs
+    convert(
+        model,
+        mapping=get_default_qat_module_mappings(),
+        inplace=True,
+        remove_qconfig=False,
+    )
+    for m in model.modules():
+        if isinstance(m, (nniqat.ConvBn2d, nnqat.Conv2d)):
+            add_input_fake_quant(m, QAT_QCONFIG.activation())
+    model.to(trainer.device)
+
+    # Per-channel observer buffers only get their [C] shape on the first
+    # forward; run one real batch so the EMA copy starts with matching shapes
+    batch = trainer.preprocess_batch(next(iter(trainer.train_loader)))
+    with torch.no_grad():
+        model(batch['img'])
+    trainer.ema = ModelEMA(model)
+
+def fold_qat_conv_bn(net):
+    """
+    Fold each QAT ConvBn2d into a plain fake-quantized conv for export
+
+    Gives Conv(DQ input, DQ weight) in the ONNX graph instead of
+    Conv -> Div -> Add -> BN.
+    """
+    for name, m in list(net.named_modules()):
+        if not isinstance(m, nniqat.ConvBn2d):
+            continue
+        weight, bias = fuse_conv_bn_weights(
+            m.weight, m.bias, m.bn.running_mean, m.bn.running_var,
+            m.bn.eps, m.bn.weight, m.bn.bias,
+        )
+        conv = nnqat.Conv2d(
+            m.in_channels, m.out_channels, m.kernel_size,
+            stride=m.stride, padding=m.padding, dilation=m.dilation,
+            groups=m.groups, bias=True, qconfig=m.qconfig,
+        )
+        conv.weight, conv.bias = weight, bias
+        # ConvBn2d fake-quantizes the BN-scaled weight, i.e. the folded one
+        conv.weight_fake_quant = m.weight_fake_quant
+        add_input_fake_quant(conv, m.input_fake_quant)
+        parent_name, _, child_name = name.rpartition('.')
+        setattr(net.get_submodule(parent_name), child_name, conv)
+
+def float_convs(onnx_path):
+    """
+    Names of Conv nodes ONNX Runtime can't run as INT8 convs
+
+    An INT8 conv needs DequantizeLinear feeding both its input and weight.
+    """
+    graph = onnx.load(onnx_path).graph
+    producers = {out: node.op_type for node in graph.node for out in node.output}
+    return [
+        node.name for node in graph.node
+        if node.op_type == 'Conv'
+        and not all(producers.get(i) == 'DequantizeLinear' for i in node.input[:2])
+    ]
+
+def can_compile():
+    """
+    Whether torch.compile can run here: PyTorch 2.x, not Windows (unsupported
+    in torch 2.1) and Triton installed for the GPU kernels
+    """
+    return (
+        hasattr(torch, 'compile')
+        and platform.system() != 'Windows'
+        and importlib.util.find_spec('triton') is not None
+    )
+
+def compile_model(trainer):
+    """
+    Ultralytics callback: compile the network's forward with torch.compile
+
+    Fuses pointwise chains (Conv -> BN -> SiLU) into fewer kernels. The
+    one-time compile cost is amortized over the training epochs. Only the
+    tensor-in/tensor-out network pass is compiled: the loss and target
+    assignment depend on the number of boxes per batch and would keep
+    recompiling. The module itself (and its state_dict keys, which the
+    EMA update relies on) stays the same.
+    """
+    trainer.model._predict_once = torch.compile(trainer.model._predict_once)
+
+def qat_finetune(
+    weights='runs/detect/screen-detector/weights/best.pt',
+    output_path='../public/models/screen-detector.qat.int8.onnx',
+    epochs=10,
+):
+    """
+    Quantization-aware fine-tuning of a trained model, exported as QDQ INT8 ONNX
+
+    The model trains with INT8 rounding simulated, so it learns to absorb
+    the quantization error that post-training quantization can't.
+
+    Args:
+        weights: Trained FP32 checkpoint to start from
+        output_path: Where to save the INT8 ONNX model
+        epochs: Number of fine-tuning epochs
+    """
+    print("🔧 Quantization-aware fine-tuning...")
+    model = YOLO(weights)
+    model.add_callback("on_pretrain_routine_end", insert_fake_quant)
+    model.train(
+        data='dataset/data.yaml',
+        epochs=epochs,
+        imgsz=640,
+        optimizer='AdamW',       # 'auto' would ignore lr0
+        lr0=1e-4,
+        batch=-1,
+        name='screen-detector-qat',
+        device=0 if torch.cuda.is_available() else 'cpu',
+        workers=min(8, os.cpu_count() or 4),
+        amp=False,               # Fake-quant needs FP32 activations
+        plots=False,
+    )
+
+    # Export the EMA weights with frozen quantization ranges
+    net = deepcopy(model.trainer.ema.ema).float().cpu().eval()
+    net.apply(disable_observer)
+    fold_qat_conv_bn(net)
+    for m in net.modules():
+        if isinstance(m, Detect):
+            m.export = True
+            m.format = 'onnx'
+            m.dynamic = False
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    torch.onnx.export(
+        net,
+        torch.zeros(1, 3, 640, 640),
+        output_path,
+        opset_version=17,
+        input_names=['images'],
+        output_names=['output0'],
+    )
+
+    size_mb = os.path.getsize(output_path) / (1024 * 1024)
+    print(f"✓ QAT INT8 model saved to: {output_path}")
+    print(f"✓ File size: {size_mb:.2f} MB")
+    # Only the frozen DFL projection in the Detect head should stay float
+    unquantized = [name for name in float_convs(output_path) if '/dfl/' not in name]
+    if unquantized:
+        print(f"⚠️  {len(unquantized)} Conv nodes lack input/weight DequantizeLinear:")
+        for name in unquantized:
+            print(f"   {name}")
+    else:
+        print("✓ Every Conv has DequantizeLinear on its input and weight")
+    print()
+
+def train_screen_detector(qat=False, use_compile=True):
     """
     Train a custom YOLOv8 model to detect screen regions
+
+    Args:
+        qat: Follow up with quantization-aware fine-tuning and INT8 export
+        use_compile: Use torch.compile on single-GPU runs where supported
     """
     
     print("=" * 60)
@@ -46,8 +286,15 @@ def train_screen_detector():
     print("✓ Model loaded")
     print()
     
+    # Use every GPU (DDP when there's more than one)
+    gpus = list(range(torch.cuda.device_count()))
+    # DDP workers are separate processes that don't get callbacks
+    if use_compile and len(gpus) == 1 and can_compile():
+        model.add_callback("on_pretrain_routine_end", compile_model)
+    
     # Train the model
     print("🚀 Starting training...")
+    print(f"Devices: {gpus or 'cpu'}")
     print("This will take 10-30 minutes depending on your hardware")
     print()
     
@@ -55,13 +302,16 @@ def train_screen_detector():
         data='dataset/data.yaml',
         epochs=100,              # Number of training iterations
         imgsz=640,               # Image size
-        batch=16,                # Batch size (reduce if out of memory)
+        # Auto-size batch to GPU memory (AutoBatch doesn't support DDP)
+        batch=-1 if len(gpus) <= 1 else 16 * len(gpus),
         name='screen-detector',  # Project name
         patience=20,             # Early stopping
         save=True,
-        device=0,                # Use GPU 0 (or 'cpu' for CPU training)
-        workers=4,
+        device=gpus or 'cpu',
+        workers=min(8, os.cpu_count() or 4),
         plots=True,
+        amp=True,                # Mixed precision on GPU (tensor cores)
+        cache='ram',             # Decode images once instead of every epoch
     )
     
     print()
@@ -81,8 +331,30 @@ def train_screen_detector():
     print(f"✓ mAP50: {metrics.box.map50:.3f}")
     print(f"✓ mAP50-95: {metrics.box.map:.3f}")
     print()
+
+    if qat:
+        qat_finetune()
     
     return model
 
+def main():
+    parser = argparse.ArgumentParser(description="Train screen region detector")
+    parser.add_argument(
+        "--qat",
+        action="store_true",
+        help="After training, fine-tune with quantization-aware training "
+             "and export an INT8 ONNX model"
+    )
+    parser.add_argument(
+        "--no-compile",
+        action="store_true",
+        help="Don't use torch.compile"
+    )
+
+    args = parser.parse_args()
+
+    train_screen_detector(qat=args.qat, use_compile=not args.no_compile)
+
+
 if __name__ == "__main__":
-    train_screen_detector()
+    main()